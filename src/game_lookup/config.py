@@ -1,56 +1,60 @@
 """Module for managing the google credentials
 """
 from typing import Union
+from functools import lru_cache
 import os
-import pickle
+import json
 from appdirs import user_config_dir
 from google.oauth2.credentials import Credentials
 
 
+@lru_cache(maxsize=None)
+def _credentials_file() -> str:
+    """Get the path to the saved credentials file, creating the config folder
+    if needed
+
+    :return: The path to the credentials file
+    """
+    # On Windows appdirs always have to be %appdir%//author//appname so
+    # makedirs will create the author folder as well
+    config_dir = user_config_dir('game_lookups', 'djnrrd')
+    os.makedirs(config_dir, exist_ok=True)
+    return os.path.join(config_dir, 'google_account.json')
+
+
 def load_google_credentials() -> Union[Credentials, None]:
-    """Attempt to load the Google credentials from a previously saved pickle
+    """Attempt to load the Google credentials from a previously saved JSON
     file
 
-    :return: The Google credentials object, or none if the pickle file
+    :return: The Google credentials object, or none if the JSON file
         doesn't exist
     """
-    # Attempt to load the pickle file
-    pickle_dir = user_config_dir('game_lookups', 'djnrrd')
-    if not os.path.isdir(pickle_dir):
-        # On Windows appdirs always have to be %appdir%//author//appname so
-        # we have to create the author folder first
-        if not os.path.isdir(os.path.join(user_config_dir(), 'djnrrd')):
-            os.mkdir(os.path.join(user_config_dir(), 'djnrrd'))
-        os.mkdir(pickle_dir)
-    pickle_file = os.path.join(pickle_dir, 'google_account.pkl')
-    if os.path.isfile(pickle_file):
-        with open(pickle_file, 'rb') as f:
-            credentials = pickle.load(f)
+    credentials_file = _credentials_file()
+    if os.path.isfile(credentials_file):
+        with open(credentials_file, 'r', encoding='utf-8') as f:
+            credentials = Credentials.from_authorized_user_info(json.load(f))
         return credentials
     return None
 
 
 def save_google_credentials(credentials: Credentials) -> None:
-    """Save the Google credentials object as a pickle file
+    """Save the Google credentials object as a JSON file, removing any
+    credentials pickled by older versions
 
     :param credentials: The Google credentials object
     """
-    pickle_dir = user_config_dir('game_lookups', 'djnrrd')
-    if not os.path.isdir(pickle_dir):
-        # On Windows appdirs always have to be %appdir%//author//appname so
-        # we have to create the author folder first
-        if not os.path.isdir(os.path.join(user_config_dir(), 'djnrrd')):
-            os.mkdir(os.path.join(user_config_dir(), 'djnrrd'))
-        os.mkdir(pickle_dir)
-    pickle_file = os.path.join(pickle_dir, 'google_account.pkl')
-    with open(pickle_file, 'wb') as f:
-        pickle.dump(credentials, f)
+    credentials_file = _credentials_file()
+    with open(credentials_file, 'w', encoding='utf-8') as f:
+        f.write(credentials.to_json())
+    # The old pickle file holds a refresh token, so don't leave it lying
+    # around once the JSON file has replaced it
+    legacy_file = os.path.join(os.path.dirname(credentials_file),
+                               'google_account.pkl')
+    if os.path.isfile(legacy_file):
+        os.remove(legacy_file)
 
 
 def delete_google_credentials() -> None:
-    """Delete the saved pickle file from disc
+    """Delete the saved JSON file from disc
     """
-    # Attempt to load the pickle file
-    pickle_dir = user_config_dir('game_lookups', 'djnrrd')
-    pickle_file = os.path.join(pickle_dir, 'google_account.pkl')
-    os.remove(pickle_file)
+    os.remove(_credentials_file())
@@ -2,13 +2,22 @@
 """
 from typing import List, Union, Dict
 from logging import Logger
+from functools import lru_cache
+from itertools import groupby
 import os
+import string
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, Resource
 from googleapiclient.errors import HttpError
 from game_lookup.config import save_google_credentials
 
+# How many times the Google client library should retry throttled or failed
+# requests, with exponential back off
+NUM_RETRIES = 3
+# How many ranges to ask for in each values.batchGet request
+RANGES_PER_REQUEST = 100
+
 
 class GoogleSheet:
     """Basic class to store the ID and title of a Google Document
@@ -27,6 +36,20 @@ class GoogleSheet:
         return self.name
 
 
+@lru_cache(maxsize=4)
+def _get_service(api: str, version: str, credentials: Credentials) \
+        -> Resource:
+    """Build a Google API service object, reusing it and its authorised HTTP
+    connection for later calls with the same credentials
+
+    :param api: The name of the Google API
+    :param version: The version of the Google API
+    :param credentials: Google credentials object
+    :return: The service object
+    """
+    return build(api, version, credentials=credentials, cache_discovery=False)
+
+
 def get_credentials(logger: Logger) -> Union[Credentials, None]:
     """Launch the user's web browser to get the OAUTH2 login credentials
 
@@ -56,42 +79,110 @@ def get_documents(credentials: Credentials, logger: Logger) \
     :param logger: A logger object
     :return: The list of spreadsheets
     """
-    with build('drive', 'v3', credentials=credentials) as service:
-        q_filter = "mimeType='application/vnd.google-apps.spreadsheet'"
-        ret_files = []
-        request = service.files().list(corpora='user', q=q_filter)
-        while request is not None:
-            try:
-                response = request.execute()
-            except HttpError as err:
-                logger.warning(err)
-                return None
-            ret_files += response['files']
-            logger.debug(f"{len(response['files'])} files found")
-            request = service.files().list_next(request, response)
-    logger.info(f"Found {len(ret_files)} spreadsheets")
+    service = _get_service('drive', 'v3', credentials)
+    q_filter = "mimeType='application/vnd.google-apps.spreadsheet'"
+    ret_files = []
+    # Drive page tokens can only be read from the previous page, so ask for
+    # the largest pages allowed and only the fields we use
+    request = service.files().list(corpora='user', q=q_filter, pageSize=1000,
+                                   fields='nextPageToken, files(id, name)')
+    while request is not None:
+        try:
+            response = request.execute(num_retries=NUM_RETRIES)
+        except HttpError as err:
+            logger.warning(err)
+            return None
+        ret_files += response['files']
+        logger.debug('%s files found', len(response['files']))
+        request = service.files().list_next(request, response)
+    logger.info('Found %s spreadsheets', len(ret_files))
     ret_files = [GoogleSheet(x['id'], x['name']) for x in ret_files]
     return ret_files
 
 
-def get_spreadsheet_range(doc_id: str, credentials: Credentials,
-                          logger: Logger) -> Union[Dict, None]:
-    """Get the expected range of game fields in the expected document
+def _first_row(sheet_range: str) -> int:
+    """Get the number of the first row of a range in A1 notation
+
+    :param sheet_range: The range in A1 notation, e.g. Sheet1!A1:H50
+    :return: The first row number
+    """
+    cells = sheet_range.rpartition('!')[2]
+    first_row = cells.split(':')[0].lstrip(string.ascii_letters)
+    return int(first_row) if first_row else 1
+
+
+def _column_ranges(rows: List[int], column: str) -> List[str]:
+    """Compact a sorted list of row numbers into ranges of contiguous rows for
+    a single column
+
+    :param rows: The sorted row numbers
+    :param column: The column letter
+    :return: The list of ranges in A1 notation, e.g. D2:D10
+    """
+    ranges = []
+    for _, group in groupby(enumerate(rows), lambda x: x[1] - x[0]):
+        group = [x[1] for x in group]
+        ranges.append(f"{column}{group[0]}:{column}{group[-1]}")
+    return ranges
+
+
+def _get_ranges(doc_id: str, ranges: List[str], credentials: Credentials,
+                logger: Logger) -> Union[List[Dict[int, List[str]]], None]:
+    """Get the rows from multiple ranges of the spreadsheet
 
     :param doc_id: The Google drive document ID
+    :param ranges: The ranges in A1 notation
     :param credentials: Google credentials object
     :param logger: A logger object
-    :return: Google spreadsheet object with the selected range
+    :return: A dictionary of row number to the values of each row, for each
+        range
     """
-    with build('sheets', 'v4', credentials=credentials) as service:
-        request = service.spreadsheets().values().get(spreadsheetId=doc_id,
-                                                      range='A:H')
+    service = _get_service('sheets', 'v4', credentials)
+    ret_ranges = []
+    # The ranges go in the URL, so don't ask for too many at once
+    for i in range(0, len(ranges), RANGES_PER_REQUEST):
+        request = service.spreadsheets().values().batchGet(
+            spreadsheetId=doc_id, ranges=ranges[i:i + RANGES_PER_REQUEST],
+            majorDimension='ROWS', fields='valueRanges(range, values)')
         try:
-            response = request.execute()
+            response = request.execute(num_retries=NUM_RETRIES)
         except HttpError as err:
             logger.warning(err)
             return None
-    return response
+        for value_range in response.get('valueRanges', []):
+            first_row = _first_row(value_range['range'])
+            ret_ranges.append({first_row + j: row for j, row
+                               in enumerate(value_range.get('values', []))})
+    return ret_ranges
+
+
+def get_lookup_rows(doc_id: str, credentials: Credentials,
+                    logger: Logger) -> Union[Dict[int, str], None]:
+    """Get the game names from the rows of the spreadsheet that haven't been
+    looked up yet, without downloading the game fields that have been
+
+    :param doc_id: The Google drive document ID
+    :param credentials: Google credentials object
+    :param logger: A logger object
+    :return: A dictionary of row number to game name
+    """
+    # Rows with a name, but no genres, keywords, rating or Steam page
+    columns = _get_ranges(doc_id, ['A:A', 'E:H'], credentials, logger)
+    if columns is None:
+        return None
+    name_column, field_columns = columns
+    names = {k: v[0] for k, v in name_column.items()
+             if v and v[0] and not any(field_columns.get(k, []))}
+    # Of those, only rows without a summary, as not finding a game only fills
+    # the summary column
+    summary_ranges = _get_ranges(doc_id, _column_ranges(sorted(names), 'D'),
+                                 credentials, logger)
+    if summary_ranges is None:
+        return None
+    summaries = {k: v for x in summary_ranges for k, v in x.items()}
+    names = {k: v for k, v in names.items() if not any(summaries.get(k, []))}
+    logger.info('Found %s rows to look up', len(names))
+    return names
 
 
 def get_permissions(doc_id, credentials: Credentials, logger: Logger) \
@@ -103,13 +194,14 @@ def get_permissions(doc_id, credentials: Credentials, logger: Logger) \
     :param logger: A logger object
     :return: the list of permissions
     """
-    with build('drive', 'v3', credentials=credentials) as service:
-        request = service.permissions().list(fileId=doc_id)
-        try:
-            response = request.execute()
-        except HttpError as err:
-            logger.warning(err)
-            return None
+    service = _get_service('drive', 'v3', credentials)
+    request = service.permissions().list(fileId=doc_id,
+                                         fields='permissions(role)')
+    try:
+        response = request.execute(num_retries=NUM_RETRIES)
+    except HttpError as err:
+        logger.warning(err)
+        return None
     return response
 
 
@@ -136,26 +228,31 @@ def pre_flight(doc_id: str, credentials: Credentials, logger: Logger) \
     return True
 
 
-def update_sheet_range(sheet: [Dict], doc_id: str,
-                       credentials: Credentials, logger: Logger) \
+def update_sheet_rows(rows: Dict[int, List[str]], doc_id: str,
+                      credentials: Credentials, logger: Logger) \
         -> Union[Dict, None]:
-    """Update the Spreadsheet range on the Google Doc
+    """Update the game fields of the looked up rows on the Google Doc in a
+    single batch update
 
-    :param sheet: Google spreadsheet object with the selected range
+    :param rows: A dictionary of row number to the game fields for the row
     :param doc_id: The Google drive document ID
     :param credentials: Google credentials object
     :param logger: A logger object
-    :return: The updated Sheet
+    :return: The batch update response
     """
-    sheet_range = sheet['range']
-    with build('sheets', 'v4', credentials=credentials) as service:
-        request = service.spreadsheets().values().update(spreadsheetId=doc_id,
-                                                         range=sheet_range,
-                                                         body=sheet,
-                                                         valueInputOption='RAW')
-        try:
-            response = request.execute()
-        except HttpError as err:
-            logger.warning(err)
-            return None
+    data = [{'range': f"D{row}:H{row}", 'values': [values]}
+            for row, values in rows.items()]
+    if not data:
+        logger.info('No rows to update')
+        return {}
+    logger.debug('Updating %s rows', len(data))
+    body = {'valueInputOption': 'RAW', 'data': data}
+    service = _get_service('sheets', 'v4', credentials)
+    request = service.spreadsheets().values().batchUpdate(
+        spreadsheetId=doc_id, body=body, fields='totalUpdatedRows')
+    try:
+        response = request.execute(num_retries=NUM_RETRIES)
+    except HttpError as err:
+        logger.warning(err)
+        return None
     return response
@@ -1,10 +1,96 @@
 """A module for looking up games on IGDB
 """
+from typing import List, Dict, Union, AsyncIterator
+from collections import deque
+from contextlib import asynccontextmanager
 import asyncio
-from typing import List, Dict
 import logging
+import time
+import aiohttp
+from aiolimiter import AsyncLimiter
 from basewebapi.asyncbasewebapi import AsyncBaseWebAPI
 
+# The maximum number of results IGDB will return for a single query
+QUERY_LIMIT = 500
+# HTTP status codes worth retrying after a back off
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# The number of times to try a query before giving up
+MAX_ATTEMPTS = 3
+# The longest time in seconds to back off between attempts
+MAX_WAIT = 8.0
+# The size of the connection pool to IGDB
+MAX_CONNECTIONS = 8
+
+
+class AdaptiveConcurrency:
+    """Limit how many requests can run at once, adding one to the limit while
+    responses are quick and halving it when requests are throttled or fail
+
+    :param initial: The starting limit
+    :param maximum: The highest the limit can grow to
+    :param target_latency: The mean response time in seconds to stay under
+    :param window: The number of response times to average
+    """
+
+    def __init__(self, initial: int = 2, maximum: int = 8,
+                 target_latency: float = 0.4, window: int = 20) -> None:
+        self.limit = initial
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._latencies = deque(maxlen=window)
+        self._successes = 0
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait until a request is allowed to run, timing it and adjusting
+        the limit once it finishes
+        """
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        start = time.monotonic()
+        throttled = False
+        try:
+            yield
+        except aiohttp.ClientResponseError as err:
+            throttled = err.status in RETRY_STATUSES
+            raise
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            throttled = True
+            raise
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                if throttled:
+                    self._decrease()
+                else:
+                    self._record(time.monotonic() - start)
+                self._condition.notify_all()
+
+    def _record(self, latency: float) -> None:
+        """Record the time a successful request took, growing the limit once
+        a full limit's worth of requests have been quick enough
+
+        :param latency: The time in seconds the request took
+        """
+        self._latencies.append(latency)
+        self._successes += 1
+        mean = sum(self._latencies) / len(self._latencies)
+        if self._successes >= self.limit and mean < self.target_latency \
+                and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+
+    def _decrease(self) -> None:
+        """Halve the limit after a throttled or failed request
+        """
+        self.limit = max(1, self.limit // 2)
+        self._latencies.clear()
+        self._successes = 0
+
 
 class IgdbAPI(AsyncBaseWebAPI):
     """Basic API to connect to IGDB
@@ -12,10 +98,11 @@ class IgdbAPI(AsyncBaseWebAPI):
     :param client_id: Twitch Client ID
     :param oauth_token: OAUTH token from Twitch
     :param logger: A logging object
+    :param max_rate: The maximum number of requests per second to IGDB
     """
 
     def __init__(self, client_id: str, oauth_token: str,
-                 logger: logging.Logger = None) -> None:
+                 logger: logging.Logger = None, max_rate: float = 4) -> None:
         super().__init__('api.igdb.com', '', '', secure=True)
         self.headers['Client-ID'] = client_id
         self.headers['Authorization'] = f"Bearer {oauth_token}"
@@ -27,27 +114,136 @@ class IgdbAPI(AsyncBaseWebAPI):
             self.logger.setLevel(logging.DEBUG)
         self.genres: Dict[int, str] = {}
         self.keywords: Dict[int, str] = {}
+        self.steam_pages: Dict[int, List[str]] = {}
+        self._searches: Dict[str, asyncio.Future] = {}
+        # IGDB allows 4 requests a second, shared by every coroutine using
+        # this object
+        self._limiter = AsyncLimiter(max_rate, time_period=1.0)
+        # How many requests can wait on IGDB at once, adjusted to how well
+        # IGDB is responding
+        self._concurrency = AdaptiveConcurrency()
+
+    async def open(self) -> None:
+        """Open an aiohttp.ClientSession with a connection pool sized for
+        concurrent lookups, keeping the connections to IGDB alive between
+        queries
+        """
+        if not self._session:
+            connector = aiohttp.TCPConnector(
+                limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS,
+                ttl_dns_cache=300,
+                keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+    async def _query(self, path: str, body: str) -> Union[List, Dict]:
+        """Send a query to IGDB, waiting for the rate limiter first and
+        backing off exponentially to retry throttled or failed requests
+
+        :param path: The API endpoint path
+        :param body: The Apicalypse query body
+        :return: The decoded JSON results
+        :raises: aiohttp.ClientResponseError for errors that can't be retried
+            or if every attempt failed
+        """
+        attempt = 0
+        while True:
+            try:
+                # Take the rate limiter first so the concurrency controller
+                # only times IGDB, not our own queue
+                async with self._limiter, self._concurrency.slot():
+                    return await self._transaction('post', path, data=body)
+            except aiohttp.ClientResponseError as err:
+                if err.status not in RETRY_STATUSES or \
+                        attempt + 1 >= MAX_ATTEMPTS:
+                    raise
+                wait = self._backoff(attempt)
+                self.logger.warning('IGDB returned %s, retrying in %.1f '
+                                    'seconds', err.status, wait)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                if attempt + 1 >= MAX_ATTEMPTS:
+                    raise
+                wait = self._backoff(attempt)
+                self.logger.warning('Could not reach IGDB (%r), retrying in '
+                                    '%.1f seconds', err, wait)
+            await asyncio.sleep(wait)
+            attempt += 1
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Work out how long to wait before retrying a query, doubling the
+        wait after each failed attempt
+
+        :param attempt: The number of the failed attempt, starting at 0
+        :return: The number of seconds to wait
+        """
+        return min(MAX_WAIT, 2.0 ** attempt)
 
     async def search_game(self, game: str) -> List[Dict]:
+        """Search for a game on IGDB, caching the results so repeated names
+        share one search, even while it is still running
+
+        :param game: The name of the Game to search for
+        :return: The list of matching games
+        """
+        key = game.strip().upper()
+        search = self._searches.get(key)
+        if search is None:
+            search = asyncio.ensure_future(self._search_game(game))
+            self._searches[key] = search
+        else:
+            self.logger.debug('Found search for %s in search cache', game)
+        try:
+            results = await search
+        except Exception:
+            # Don't cache failures, the next search should try again
+            if self._searches.get(key) is search:
+                del self._searches[key]
+            raise
+        # Callers update the results, so give them their own copies
+        return [dict(x) for x in results]
+
+    async def _search_game(self, game: str) -> List[Dict]:
         """Search for a game on IGDB
 
         :param game: The name of the Game to search for
         :return: The list of matching games
         """
-        self.logger.info(f"Searching for {game}")
+        self.logger.info('Searching for %s', game)
         path = '/v4/games'
         body = f"search \"{game}\";\n" \
                f"fields name,summary,genres,keywords,rating;"
-        results = await self._transaction('post', path, data=body)
-        self.logger.debug(f"IGDB returned {results}")
-        self.logger.info(f"Found {len(results)} results")
-        for result in results:
-            result['genres'] = await self.get_genres(result.get('genres'))
-            result['keywords'] = await self.get_keywords(result.get('keywords'))
-            await asyncio.sleep(0.33)
-            result['steampage'] = await self.get_steam_page(result['id'])
+        results = await self._query(path, body)
+        self.logger.debug('IGDB returned %s', results)
+        self.logger.info('Found %s results', len(results))
         return results
 
+    async def add_game_details(self, games: List[Dict]) -> None:
+        """Replace the genre and keyword IDs of the games with their names and
+        add their Steam pages. Anything missing from the caches is looked up
+        with one batch of queries for all the games
+
+        :param games: The games returned from search_game
+        """
+        genre_ids = {x for game in games for x in game.get('genres') or []}
+        keyword_ids = {x for game in games
+                       for x in game.get('keywords') or []}
+        # Warm up the caches, the lookups don't depend on each other so let
+        # them share the rate limiter
+        await asyncio.gather(self.get_genres(list(genre_ids)),
+                             self.get_keywords(list(keyword_ids)),
+                             self.get_steam_pages([game['id']
+                                                   for game in games]))
+        # Read the warm caches directly, so IDs IGDB didn't return aren't
+        # looked up again for every game
+        for game in games:
+            genre_ids = game.get('genres')
+            game['genres'] = None if genre_ids is None else \
+                [self.genres[x] for x in genre_ids if x in self.genres]
+            keyword_ids = game.get('keywords')
+            game['keywords'] = None if keyword_ids is None else \
+                [self.keywords[x] for x in keyword_ids if x in self.keywords]
+            game['steampage'] = self.steam_pages[game['id']]
+
     async def get_genres(self, genre_ids: List[int]) -> List[str]:
         """Get the genres for the list of genre IDs provided, caching entries
         from IGDB
@@ -55,30 +251,15 @@ class IgdbAPI(AsyncBaseWebAPI):
         :param genre_ids: The list of IDs
         :return: A list of genre names
         """
-        lookup_ids = []
-        ret_list = []
-        if genre_ids is not None:
-            # Try the local cache first
-            for genre_id in genre_ids:
-                genre_name = self.genres.get(genre_id)
-                if genre_name:
-                    self.logger.debug(f"Found {genre_name} for {genre_id} in "
-                                      f"genre cache")
-                    ret_list.append(genre_name)
-                else:
-                    self.logger.debug(f"Did not find {genre_id} in genre cache")
-                    lookup_ids.append(genre_id)
-            # If nothing was in the cache
-            if lookup_ids:
-                self.logger.info(f"Looking up genre IDs {lookup_ids} after "
-                                 f"sleep")
-                await asyncio.sleep(0.33)
-                lookups = await self._get_genres(lookup_ids)
-                self.genres.update(lookups)
-                return await self.get_genres(genre_ids)
-            return ret_list
-        self.logger.debug('No Genre IDs for game')
-        return None
+        if genre_ids is None:
+            self.logger.debug('No Genre IDs for game')
+            return None
+        # Try the local cache first
+        lookup_ids = [x for x in genre_ids if x not in self.genres]
+        if lookup_ids:
+            self.logger.info('Looking up genre IDs %s', lookup_ids)
+            self.genres.update(await self._get_genres(lookup_ids))
+        return [self.genres[x] for x in genre_ids if x in self.genres]
 
     async def _get_genres(self, genre_ids: List[int]) -> Dict[int, str]:
         """Get the genres from IGDB
@@ -86,13 +267,16 @@ class IgdbAPI(AsyncBaseWebAPI):
         :param genre_ids: a list of the genre IDs
         :return: a dictionary of id to genre name
         """
-        genre_ids = [str(x) for x in genre_ids]
         path = '/v4/genres'
-        body = f"where id = ({','.join(genre_ids)});\n" \
-               f"fields name;"
-        results = await self._transaction('post', path, data=body)
-        self.logger.debug(f"Received {results} from IGDB for genres")
-        results = {x['id']: x['name'] for x in results}
+        results = {}
+        for i in range(0, len(genre_ids), QUERY_LIMIT):
+            batch = [str(x) for x in genre_ids[i:i + QUERY_LIMIT]]
+            body = f"where id = ({','.join(batch)});\n" \
+                   f"fields name;\n" \
+                   f"limit {QUERY_LIMIT};"
+            response = await self._query(path, body)
+            self.logger.debug('Received %s from IGDB for genres', response)
+            results.update({x['id']: x['name'] for x in response})
         return results
 
     async def get_keywords(self, keyword_ids: List[int]) -> List[str]:
@@ -102,31 +286,15 @@ class IgdbAPI(AsyncBaseWebAPI):
         :param keyword_ids: The list of IDs
         :return: A list of keywords
         """
-        lookup_ids = []
-        ret_list = []
-        if keyword_ids is not None:
-            # Try the local cache first
-            for keyword_id in keyword_ids:
-                keyword = self.keywords.get(keyword_id)
-                if keyword:
-                    self.logger.debug(f"Found {keyword} for {keyword_id} in "
-                                      f"genre cache")
-                    ret_list.append(keyword)
-                else:
-                    self.logger.debug(f"Did not find {keyword_id} in keyword "
-                                      f"cache")
-                    lookup_ids.append(keyword_id)
-            # If nothing was in the cache
-            if lookup_ids:
-                self.logger.info(f"Looking up keyword IDs {lookup_ids} after "
-                                 f"sleep")
-                await asyncio.sleep(0.33)
-                lookups = await self._get_keywords(lookup_ids)
-                self.keywords.update(lookups)
-                return await self.get_keywords(keyword_ids)
-            return ret_list
-        self.logger.debug('No Keyword IDs for game')
-        return None
+        if keyword_ids is None:
+            self.logger.debug('No Keyword IDs for game')
+            return None
+        # Try the local cache first
+        lookup_ids = [x for x in keyword_ids if x not in self.keywords]
+        if lookup_ids:
+            self.logger.info('Looking up keyword IDs %s', lookup_ids)
+            self.keywords.update(await self._get_keywords(lookup_ids))
+        return [self.keywords[x] for x in keyword_ids if x in self.keywords]
 
     async def _get_keywords(self, keyword_ids: List[int]) -> Dict[int, str]:
         """Get the keywords from IGDB
@@ -134,26 +302,51 @@ class IgdbAPI(AsyncBaseWebAPI):
         :param keyword_ids: a list of the keyword IDs
         :return: a dictionary of id to keyword
         """
-        keyword_ids = [str(x) for x in keyword_ids]
         path = '/v4/keywords'
-        body = f"where id = ({','.join(keyword_ids)});\n" \
-               f"fields name;"
-        results = await self._transaction('post', path, data=body)
-        self.logger.debug(f"Received {results} from IGDB for keywords")
-        results = {x['id']: x['name'] for x in results}
+        results = {}
+        for i in range(0, len(keyword_ids), QUERY_LIMIT):
+            batch = [str(x) for x in keyword_ids[i:i + QUERY_LIMIT]]
+            body = f"where id = ({','.join(batch)});\n" \
+                   f"fields name;\n" \
+                   f"limit {QUERY_LIMIT};"
+            response = await self._query(path, body)
+            self.logger.debug('Received %s from IGDB for keywords', response)
+            results.update({x['id']: x['name'] for x in response})
         return results
 
-    async def get_steam_page(self, game_id: int) -> List[str]:
-        """Get the Steam page from IGDB
+    async def get_steam_pages(self, game_ids: List[int]) \
+            -> Dict[int, List[str]]:
+        """Get the Steam pages for the list of game IDs provided, caching
+        entries from IGDB
 
-        :param game_id: The ID of the game
-        :return: The URL to the steam page
+        :param game_ids: The list of game IDs
+        :return: A dictionary of game ID to the URLs of its Steam pages
         """
-        self.logger.info(f"Looking up Steam page for game ID {game_id}")
+        lookup_ids = [x for x in dict.fromkeys(game_ids)
+                      if x not in self.steam_pages]
         path = '/v4/websites'
-        body = f"where game = {game_id} & category = 13;\n" \
-               f"fields url;"
-        results = await self._transaction('post', path, data=body)
-        self.logger.debug(f"Received {results} from IGDB for Steam webpage")
-        results = [x['url'] for x in results]
-        return results
+        for i in range(0, len(lookup_ids), QUERY_LIMIT):
+            batch = lookup_ids[i:i + QUERY_LIMIT]
+            self.logger.info('Looking up Steam pages for game IDs %s',
+                             batch)
+            for game_id in batch:
+                self.steam_pages[game_id] = []
+            offset = 0
+            while True:
+                body = f"where game = ({','.join(str(x) for x in batch)}) " \
+                       f"& category = 13;\n" \
+                       f"fields game,url;\n" \
+                       f"sort id asc;\n" \
+                       f"limit {QUERY_LIMIT};\n" \
+                       f"offset {offset};"
+                results = await self._query(path, body)
+                self.logger.debug('Received %s from IGDB for Steam webpages',
+                                  results)
+                for result in results:
+                    self.steam_pages[result['game']].append(result['url'])
+                # Games can have more than one Steam page, so there can be
+                # more results than games
+                if len(results) < QUERY_LIMIT:
+                    break
+                offset += QUERY_LIMIT
+        return {x: self.steam_pages[x] for x in game_ids}
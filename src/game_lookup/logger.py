@@ -1,28 +1,54 @@
 """A module for setting up the logger and custom TK Scrolled Text log handler
 """
+from typing import Tuple
 import logging
+from logging.handlers import QueueHandler, MemoryHandler
+from queue import Queue, Empty
+from collections import deque
 from tkinter import END, Text
-from datetime import datetime
+import time
 
+# How many lines to write to the log widget between checks of its length
+TRIM_INTERVAL = 100
 
-def setup_logger(app: 'GameLookupApp', debug: bool = False) -> logging.Logger:
+
+def setup_logger(app: 'GameLookupApp', debug: bool = False) \
+        -> Tuple[logging.Logger, 'TkTextHandler']:
     """Setup the logger for the application that uses the tkinter scrolling
     text box for the logs
 
+    Pass values to the logger as arguments, e.g.
+    ``logger.debug('Received %s', results)``, rather than formatting them
+    into the message first, so they are only formatted when the message will
+    be shown
+
     :param app: The tkinter application
     :param debug: If debug messages should be logged
-    :return: A Logger object
+    :return: A Logger object and the Tk text handler
     """
+    # Records are passed to the Tk text handler through a queue, so logging
+    # from other threads never touches the widget
+    log_queue = Queue()
+    # Hold records in memory and pass them to the queue in bursts, warnings
+    # and errors are passed on straight away. The buffer is flushed when
+    # logging shuts down
+    buffer_handler = MemoryHandler(64, flushLevel=logging.WARNING,
+                                   target=QueueHandler(log_queue),
+                                   flushOnClose=True)
     # Create textLogger
-    text_handler = TkTextHandler(app.doc_log)
-    # Create a custom logger and add the Tk text handler
+    text_handler = TkTextHandler(app.doc_log, log_queue,
+                                 buffer_handler=buffer_handler)
+    # Create a custom logger and add the queue handler
     logger = logging.getLogger('game_lookups')
     if debug:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
-    logger.addHandler(text_handler)
-    return logger
+    # Everything is shown in the app, don't pass it on to the root logger
+    logger.propagate = False
+    logger.addHandler(buffer_handler)
+    text_handler.poll()
+    return logger, text_handler
 
 
 class TkTextHandler(logging.Handler):
@@ -31,37 +57,125 @@ class TkTextHandler(logging.Handler):
     https://gist.github.com/moshekaplan/c425f861de7bbf28ef06
 
     :param tk_widget: Tkinter scrolled text widget to write to
+    :param log_queue: The queue of log records to poll from the Tk main loop
+    :param buffer_handler: The handler buffering records for the queue, to
+        flush each time the queue is polled
+    :param poll_interval: How often to poll the queue in milliseconds
+    :param max_lines: The most lines of history to keep in the widget
     """
+    # The colour tag to use for each level name
+    _LEVEL_TAG = {'DEBUG': 'green_level',
+                  'INFO': 'green_level',
+                  'WARNING': 'red_level',
+                  'ERROR': 'red_level',
+                  'CRITICAL': 'red_level'}
 
-    def __init__(self, tk_widget: Text, *args, **kwargs) -> None:
+    def __init__(self, tk_widget: Text, log_queue: Queue, *args,
+                 buffer_handler: MemoryHandler = None,
+                 poll_interval: int = 100, max_lines: int = 5000,
+                 **kwargs) -> None:
         super().__init__(*args, **kwargs)
         # Store a reference to the scrolled Text it will log to
         self.tk_widget = tk_widget
+        self.log_queue = log_queue
+        self.buffer_handler = buffer_handler
+        self.poll_interval = poll_interval
+        self.max_lines = max_lines
+        # Lines written since the line count was last checked
+        self._unchecked_lines = 0
+        self.setFormatter(logging.Formatter('%(message)s'))
+        # Tags keep their settings for the life of the widget
+        self.tk_widget.tag_config('green_level', foreground='green')
+        self.tk_widget.tag_config('red_level', foreground='red')
+        # Records waiting to be written to the widget
+        self._pending = deque()
+        # Set to False when the handler is closed, so nothing is written to
+        # the widget while the app is shutting down
+        self._alive = True
+        # Bind the callbacks once rather than on every poll
+        self._poll_callback = self.poll
+        self._flush_callback = self.flush_records
+
+    def poll(self) -> None:
+        """Schedule the waiting records to be written to the widget when Tk is
+        next idle, then poll again after the interval. This must be called
+        from the Tk main loop
+        """
+        if not self._alive or not self.tk_widget.winfo_exists():
+            return
+        # Writing to the widget can wait until user input has been handled
+        self.tk_widget.after_idle(self._flush_callback)
+        self.tk_widget.after(self.poll_interval, self._poll_callback)
+
+    def flush_records(self) -> None:
+        """Flush the buffered records to the queue, then handle every record
+        in the queue and write them to the widget. This must be called from
+        the Tk main loop
+        """
+        if not self._alive:
+            return
+        if self.buffer_handler:
+            self.buffer_handler.flush()
+        while True:
+            try:
+                record = self.log_queue.get_nowait()
+            except Empty:
+                break
+            self.handle(record)
+        if self._pending:
+            self._drain()
 
     def emit(self, record) -> None:
-        """Override the normal Hanler emit method to write to a tkinter
-        scrolled text widget
+        """Override the normal Hanler emit method to hold the record for the
+        tkinter scrolled text widget until the poll has handled the queue
 
         :param record: The log record
         """
-        def append() -> None:
-            """Nested function to call in the program loop
-            """
-            self.tk_widget.configure(state='normal')
-            if record.levelname in ('INFO', 'DEBUG'):
-                self.tk_widget.insert(END, f"{record.levelname}", 'green_level')
-            else:
-                self.tk_widget.insert(END, f"{record.levelname}", 'red_level')
-            self.tk_widget.insert(END, f" - "
-                                       f"{datetime.now().strftime('%H:%M:%S')}"
-                                       f" - ", 'time')
-            self.tk_widget.insert(END, f"{record.msg}\n", 'message')
-
-            self.tk_widget.tag_config('green_level', foreground='green')
-            self.tk_widget.tag_config('red_level', foreground='red')
-            self.tk_widget.configure(state='disabled')
-            # Autoscroll to the bottom
-            self.tk_widget.yview(END)
-        # This is necessary because we can't modify the Text from other
-        # threads, we have to add it to the loop
-        self.tk_widget.after(0, append)
+        if not self._alive:
+            return
+        # Records from the queue haven't been through the logger's level
+        # checks for this handler
+        if record.levelno < self.level:
+            return
+        # Use the time the record was logged, not the time it was handled
+        timestamp = time.strftime('%H:%M:%S', time.localtime(record.created))
+        self._pending.append((record.levelname, timestamp,
+                              self.format(record)))
+
+    def close(self) -> None:
+        """Stop writing to the widget, this should be called before the widget
+        is destroyed
+        """
+        self._alive = False
+        super().close()
+
+    def _drain(self) -> None:
+        """Write all the held records to the tkinter scrolled text widget
+        """
+        records = list(self._pending)
+        self._pending.clear()
+        self.tk_widget.configure(state='normal')
+        # Text.insert takes alternating text and tags, so the whole batch
+        # can be written with a single Tk call
+        chunks = []
+        for levelname, timestamp, msg in records:
+            chunks += [levelname, self._LEVEL_TAG.get(levelname, 'red_level'),
+                       f" - {timestamp} - ", 'time',
+                       f"{msg}\n", 'message']
+        self.tk_widget.insert(END, *chunks)
+        # Only count the lines every so often, it's another call to Tk
+        self._unchecked_lines += len(records)
+        if self._unchecked_lines >= TRIM_INTERVAL:
+            self._unchecked_lines = 0
+            self._trim()
+        self.tk_widget.configure(state='disabled')
+        # Autoscroll to the bottom
+        self.tk_widget.yview(END)
+
+    def _trim(self) -> None:
+        """Delete the oldest lines from the widget when there are more than
+        max_lines, to bound its memory and redraw cost
+        """
+        end_line = int(self.tk_widget.index('end-1c').split('.')[0])
+        if end_line > self.max_lines:
+            self.tk_widget.delete('1.0', f"{end_line - self.max_lines}.0")
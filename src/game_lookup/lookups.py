@@ -8,10 +8,15 @@ import asyncio
 from logging import Logger
 from google.oauth2.credentials import Credentials
 from game_lookup_conf import twitch
-from game_lookup.google import pre_flight, get_spreadsheet_range, update_sheet_range
+from game_lookup.google import pre_flight, get_lookup_rows, update_sheet_rows
 from game_lookup.twitch import AsyncTwitchIDAPI
 from game_lookup.igdb import IgdbAPI
 
+# The most rows to send to Google in one update
+UPLOAD_BATCH_SIZE = 50
+# The longest time in seconds to hold a row before sending it to Google
+UPLOAD_MAX_WAIT = 2.0
+
 
 async def get_twitch_oauth(logger: Logger) -> Tuple[str, str]:
     """Get the OAUTH token from Twitch
@@ -24,7 +29,7 @@ async def get_twitch_oauth(logger: Logger) -> Tuple[str, str]:
     return twitch.CLIENT_ID, oauth_token
 
 
-def match_game(name: str, games: Dict, logger: Logger) -> List[str]:
+def match_game(name: str, games: List[Dict], logger: Logger) -> List[str]:
     """Try to match an exact game from the provided string to the potential
     multiple results from IGDB
 
@@ -39,8 +44,8 @@ def match_game(name: str, games: Dict, logger: Logger) -> List[str]:
         return ['NO MATCHING GAMES']
     if len(games) > 1:
         logger.info('Multiple matches found, looking for exact matches')
-        filtered_games = [x for x in games
-                          if x['name'].upper() == name.upper()]
+        target = name.casefold()
+        filtered_games = [x for x in games if x['name'].casefold() == target]
         # If it's still multiple matches
         if len(filtered_games) > 1:
             logger.warning('Multiple exact matches found, update sheet '
@@ -49,13 +54,13 @@ def match_game(name: str, games: Dict, logger: Logger) -> List[str]:
         if len(filtered_games) == 0:
             logger.warning('No exact matches found, Update Column A with '
                            'correct title')
-            return ['NO EXACT MATCHES'] + [','.join([x['name'] for x in games])]
+            return ['NO EXACT MATCHES', ','.join(x['name'] for x in games)]
         # We should only have one game left
-        game = filtered_games.pop()
+        game = filtered_games[0]
     else:
         # We only had one game to start with
-        game = games.pop()
-    logger.info(f"Adding game {game['name']} to sheet")
+        game = games[0]
+    logger.info('Adding game %s to sheet', game['name'])
     genres = ','.join(game['genres']) if game['genres'] is not None else ''
     keywords = ','.join(game['keywords']) \
         if game['keywords'] is not None else ''
@@ -65,26 +70,95 @@ def match_game(name: str, games: Dict, logger: Logger) -> List[str]:
             steampage]
 
 
-async def loop_sheet(sheet: Dict, logger: Logger) -> Dict:
+async def loop_sheet(rows: Dict[int, str], queue: asyncio.Queue,
+                     logger: Logger, batch_size: int = 50) -> None:
     """Loop through the rows of the Google sheet and lookup the games on IGDB
+    in batches, adding each finished row to the queue
 
-    :param sheet: The Google Sheet
+    :param rows: A dictionary of row number to game name
+    :param queue: The queue to add the row number and game fields of each
+        finished row to
     :param logger: The custom logger object
-    :return: The updated Google Sheet
+    :param batch_size: The number of rows to look up details for at once
     """
     client_id, oauth_token = await get_twitch_oauth(logger)
+    rows = list(rows.items())
     async with IgdbAPI(client_id, oauth_token, logger) as igdb:
-        for row in sheet['values']:
-            # Fill in gaps if needed
-            while len(row) < 3:
-                logger.debug('Beefing out entry to 3 columns')
-                row.append('')
-            # Lookup anything not looked up
-            if len(row) == 3:
-                logger.info(f"Looking up game {row[0]}")
-                games = await igdb.search_game(row[0])
-                row += match_game(row[0], games, logger)
-    return sheet
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            # IgdbAPI limits how many searches are sent at once
+            results = await asyncio.gather(*(igdb.search_game(name)
+                                             for _, name in batch))
+            logger.info('Looking up genres, keywords and Steam pages')
+            await igdb.add_game_details([game for games in results
+                                         for game in games])
+            for (row, name), games in zip(batch, results):
+                await queue.put((row, match_game(name, games, logger)))
+
+
+async def upload_rows(queue: asyncio.Queue, doc_id: str,
+                      credentials: Credentials, logger: Logger) -> bool:
+    """Update the Google sheet with the rows from the queue in batches, until
+    a None is taken from the queue
+
+    :param queue: The queue of row numbers and game fields
+    :param doc_id: The Google Drive ID
+    :param credentials: The Google credentials object
+    :param logger: The custom logger
+    :return: True if every update succeeded
+    """
+    loop = asyncio.get_running_loop()
+    success = True
+    finished = False
+    while not finished:
+        rows = {}
+        deadline = None
+        while len(rows) < UPLOAD_BATCH_SIZE:
+            timeout = None if deadline is None \
+                else max(0.0, deadline - loop.time())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                finished = True
+                break
+            if deadline is None:
+                deadline = loop.time() + UPLOAD_MAX_WAIT
+            rows[item[0]] = item[1]
+        if rows:
+            logger.debug('Sending %s rows to Google', len(rows))
+            # The Google client blocks, so don't hold up the lookups
+            response = await loop.run_in_executor(None, update_sheet_rows,
+                                                  rows, doc_id, credentials,
+                                                  logger)
+            if response is None:
+                success = False
+    return success
+
+
+async def lookup_sheet(rows: Dict[int, str], doc_id: str,
+                       credentials: Credentials, logger: Logger) -> bool:
+    """Lookup the games on IGDB while updating the Google sheet with the rows
+    that have finished
+
+    :param rows: A dictionary of row number to game name
+    :param doc_id: The Google Drive ID
+    :param credentials: The Google credentials object
+    :param logger: The custom logger
+    :return: True if every update succeeded
+    """
+    queue = asyncio.Queue()
+    uploader = asyncio.ensure_future(upload_rows(queue, doc_id, credentials,
+                                                 logger))
+    try:
+        await loop_sheet(rows, queue, logger)
+    finally:
+        # Let the uploader send any rows that finished, even if the lookups
+        # failed
+        await queue.put(None)
+        success = await uploader
+    return success
 
 
 def do_game_sheet(doc_id: str, credentials: Credentials, logger: Logger) \
@@ -99,19 +173,18 @@ def do_game_sheet(doc_id: str, credentials: Credentials, logger: Logger) \
     if not pre_flight(doc_id, credentials, logger):
         return
     logger.info('Getting spreadsheet from Google')
-    sheet = get_spreadsheet_range(doc_id, credentials, logger)
-    if sheet is not None:
+    rows = get_lookup_rows(doc_id, credentials, logger)
+    success = False
+    if rows is not None:
         logger.debug('Starting async loop for lookups')
         if platform.system() == 'Windows':
             asyncio.set_event_loop_policy(
                 asyncio.WindowsSelectorEventLoopPolicy())
         loop = asyncio.new_event_loop()
-        sheet = loop.run_until_complete(
-            loop_sheet(sheet, logger)
+        success = loop.run_until_complete(
+            lookup_sheet(rows, doc_id, credentials, logger)
         )
-        logger.debug('Lookups complete, updating sheet on Google API')
-        sheet = update_sheet_range(sheet, doc_id, credentials, logger)
-    if sheet is None:
+    if not success:
         logger.warning('Something went wrong with the sheet')
     else:
         logger.info('Sheet updated. All done.')
@@ -1,9 +1,12 @@
 """A Module for the main TK application
 """
+from typing import Union
+from threading import Thread
 import tkinter as tk
 from tkinter import font as tk_font
 from tkinter import scrolledtext, messagebox, DISABLED
 from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
 from game_lookup import text_includes as ti
 from game_lookup.logger import setup_logger
 from game_lookup.google import get_documents, get_credentials
@@ -41,9 +44,10 @@ class GameLookupApp(tk.Tk):
         start_btn_path = 'doc_selector.doc_action.start_btn'
         self.start_btn = self.nametowidget(start_btn_path)
         # App specific setups
-        self.logger = setup_logger(self, debug)
+        self.logger, self.log_handler = setup_logger(self, debug)
         self.google_credentials = None
         self.google_sheets = []
+        self.protocol('WM_DELETE_WINDOW', self.close)
 
     def _build_menu(self) -> tk.Menu:
         """Build the main application menu
@@ -52,10 +56,16 @@ class GameLookupApp(tk.Tk):
         """
         menu_bar = tk.Menu(self)
         file_menu = tk.Menu(menu_bar, tearoff=0)
-        file_menu.add_command(label="Exit", command=self.quit)
+        file_menu.add_command(label="Exit", command=self.close)
         menu_bar.add_cascade(label="File", menu=file_menu)
         return menu_bar
 
+    def close(self) -> None:
+        """Stop logging to the log area and close the app
+        """
+        self.log_handler.close()
+        self.destroy()
+
     def load_doc_list(self) -> None:
         """Load a list of document titles into the scrolling listbox
         """
@@ -67,8 +77,9 @@ class GameLookupApp(tk.Tk):
             try:
                 self.google_sheets = get_documents(self.google_credentials,
                                                    self.logger)
-                for sheet in self.google_sheets:
-                    self.doc_list.insert('end', sheet)
+                # Insert every sheet with one Tk call and redraw once
+                self.doc_list.insert('end', *self.google_sheets)
+                self.doc_list.update_idletasks()
             except RefreshError as err:
                 self.logger.warning('Credentials have expired, deleting '
                                     'cached credentials.')
@@ -87,11 +98,28 @@ class GameLookupApp(tk.Tk):
                 self.logger.info('No login credentials saved on disc, '
                                  'launching browser')
                 messagebox.showinfo(ti.LOGIN_HEADING, ti.LOGIN_MSG)
-                self.google_credentials = get_credentials(self.logger)
-                if self.google_credentials:
-                    self.logger.debug('Login credentials received from Google '
-                                      'and added to object')
-                    self.load_doc_list()
+                # The OAUTH flow waits for the browser, so keep it off the
+                # main loop
+                oauth = Thread(target=self._do_oauth, daemon=True)
+                oauth.start()
+
+    def _do_oauth(self) -> None:
+        """Get the login credentials from Google in a separate thread and pass
+        them back to the main loop
+        """
+        credentials = get_credentials(self.logger)
+        self.after_idle(self._finish_oauth, credentials)
+
+    def _finish_oauth(self, credentials: Union[Credentials, None]) -> None:
+        """Store the login credentials from Google and load the document list
+
+        :param credentials: The Google credentials object
+        """
+        if credentials:
+            self.google_credentials = credentials
+            self.logger.debug('Login credentials received from Google and '
+                              'added to object')
+            self.load_doc_list()
 
     def start_game_lookup(self) -> None:
         """Start looking up the game titles from the Google sheet in GameDB
@@ -99,7 +127,7 @@ class GameLookupApp(tk.Tk):
         idx = self.doc_list.curselection()
         if idx:
             sheet_id = self.google_sheets[idx[0]].id
-            self.logger.debug(f"Looking up Sheet ID {sheet_id}")
+            self.logger.debug('Looking up Sheet ID %s', sheet_id)
             self.start_btn['state'] = DISABLED
             start_lookup_thread(sheet_id, self.google_credentials, self.logger)
 
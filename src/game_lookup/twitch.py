@@ -33,5 +33,5 @@ class AsyncTwitchIDAPI(AsyncBaseWebAPI):
                   'client_secret': self.client_secret,
                   'grant_type': 'client_credentials'}
         response = await self._transaction('post', path, params=params)
-        self.logger.debug(f"Received {response} from Twitch API")
+        self.logger.debug('Received %s from Twitch API', response)
         return response['access_token']